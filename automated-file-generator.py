@@ -1,24 +1,208 @@
 import sys
 import os
-import subprocess
+import concurrent.futures
 import shutil
 import platform
 import time
-import glob 
+import traceback
+import tempfile
+import hashlib
+import gzip
+import mmap
+import io
+import contextlib
+import pathlib
+import heapq
+import functools
+import string
 import xml.etree.ElementTree as ET
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 from collections import Counter
-from typing import Tuple, List, Optional
+from typing import Callable, Dict, Tuple, List, Optional
 
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
                              QWidget, QPushButton, QLabel, QLineEdit, QSpinBox, 
                              QTabWidget, QMessageBox, QTextEdit, QFileDialog, QSplitter)
-from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineProfile
+from PyQt5.QtWebChannel import QWebChannel
+from PyQt5.QtCore import QObject, QThread, QProcess, QEventLoop, QTimer, QUrl, pyqtSignal, pyqtSlot, Qt
 
 MIN_OSM_FILE_SIZE = 1024 * 10 
+LOG_FLUSH_INTERVAL_MS = 50
+LOG_MAX_LINES = 5000
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "veins-scenario-gen")
+OSM_CACHE_DIR = os.path.join(CACHE_DIR, "osm")
+NET_CACHE_DIR = os.path.join(CACHE_DIR, "net")
+DEFAULT_MAP_CENTER = (34.0522, -118.2437)  # Los Angeles
+DEFAULT_MAP_ZOOM = 13
+APP_USER_AGENT_TAG = "VeinsScenarioGenerator"
+MIN_TRIPS_PER_SHARD = 1000
+ROUTES_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                 'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">\n')
+
+NETCONVERT_OPTIONS = [
+    "--junctions.join",              # Joins nearby nodes into single intersections
+    "--no-internal-links", "false",  # Crucial: enables physical turns for blocking
+    "--keep-edges.components", "1",  # Deletes disconnected "island" roads
+    "--tls.join",                    # Groups traffic lights at large junctions
+    "--geometry.remove",             # Simplifies road shapes for better performance
+    "--roundabouts.guess"            # Identifies roundabouts for better routing
+]
+
+class LogStream(io.TextIOBase):
+    """Text stream that hands every complete line written to it to a log callback."""
+    def __init__(self, log: Callable[[str], None]):
+        super().__init__()
+        self._log = log
+        self._pending = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._log(line.rstrip())
+        return len(text)
+
+    def close(self):
+        if self._pending:
+            self._log(self._pending.rstrip())
+            self._pending = ""
+        super().close()
+
+def needs_rebuild(output: str, *inputs: str) -> bool:
+    """Make-style check: True if output is missing or older than any of its inputs."""
+    try:
+        output_mtime = os.path.getmtime(output)
+    except FileNotFoundError:
+        return True
+    return any(os.path.getmtime(i) > output_mtime for i in inputs)
+
+def publish_output(succeeded: bool, partial: str, output: str) -> bool:
+    """Moves a tool's finished output into place, or discards it if the tool failed."""
+    if succeeded:
+        os.replace(partial, output)
+        return True
+    try:
+        os.unlink(partial)
+    except FileNotFoundError:
+        pass
+    return False
+
+def write_if_changed(name: str, content: str) -> bool:
+    """Writes content to name unless the file already holds it, keeping its mtime intact."""
+    path = pathlib.Path(name)
+    data = content.encode("utf-8")
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    return True
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hashes a file through a read-only memory map, avoiding a copy of its contents."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return h.hexdigest()  # empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            for i in range(0, len(view), chunk_size):
+                h.update(view[i:i + chunk_size])
+    return h.hexdigest()
+
+def gzip_file(src: str, dst: str):
+    """Compresses src into dst, replacing dst only once it is complete."""
+    tmp = f"{dst}.tmp"
+    with open(src, 'rb') as f_in, gzip.open(tmp, 'wb', compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.replace(tmp, dst)
+
+def gunzip_file(src: str, dst: str):
+    """Decompresses src into dst, replacing dst only once it is complete."""
+    tmp = f"{dst}.tmp"
+    with gzip.open(src, 'rb') as f_in, open(tmp, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.replace(tmp, dst)
+
+def link_or_copy(src: str, dst: str):
+    """Hardlinks src to dst (replacing dst), falling back to a copy across filesystems."""
+    tmp = f"{dst}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def iter_top_level_elements(xml_file: str):
+    """Streams the direct children of the root element, freeing each one once consumed."""
+    root = None
+    depth = 0
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                yield elem
+                root.clear()
+
+def split_trips(trip_file: str, shard_files: List[str]) -> List[str]:
+    """Deals the trips round-robin into shard_files and copies other definitions to all of them.
+
+    Round-robin keeps every shard sorted by departure time. Returns the serialized
+    non-trip definitions (e.g. vTypes) so they can be written once when merging.
+    """
+    definitions = []
+    with contextlib.ExitStack() as stack:
+        shards = [stack.enter_context(open(f, 'w', encoding='utf-8')) for f in shard_files]
+        for shard in shards:
+            shard.write(ROUTES_HEADER)
+        count = 0
+        for elem in iter_top_level_elements(trip_file):
+            elem.tail = None
+            text = f"    {ET.tostring(elem, encoding='unicode')}\n"
+            if elem.tag == 'trip':
+                shards[count % len(shards)].write(text)
+                count += 1
+            else:
+                definitions.append(text)
+                for shard in shards:
+                    shard.write(text)
+        for shard in shards:
+            shard.write("</routes>\n")
+    return definitions
+
+def merge_routes(route_files: List[str], output_file: str, definitions: List[str]):
+    """Merges departure-sorted duarouter outputs into one route file, keeping departure order."""
+    def vehicles(route_file):
+        for elem in iter_top_level_elements(route_file):
+            if elem.tag == 'vehicle':
+                elem.tail = None
+                yield float(elem.get('depart')), ET.tostring(elem, encoding='unicode')
+
+    with open(output_file, 'w', encoding='utf-8') as out:
+        out.write(ROUTES_HEADER)
+        out.writelines(definitions)
+        for _, text in heapq.merge(*(vehicles(f) for f in route_files), key=lambda item: item[0]):
+            out.write(f"    {text}\n")
+        out.write("</routes>\n")
 
 class PlotViewer(QWidget):
     """A QWidget that contains a Matplotlib figure."""
@@ -63,17 +247,22 @@ def create_most_used_edges_plot(top_edges: List[Tuple[str, int]], filename: str)
     fig.tight_layout()
     return fig
 
-MAP_HTML = """
+MAP_TEMPLATE = string.Template("""
 <!DOCTYPE html>
 <html>
 <head>
     <title>SUMO Map Selector</title>
     <meta charset="utf-8" />
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <!-- Tiles are only requested once leaflet.js has run; open their connections now -->
+    <link rel="preconnect" href="https://a.tile.openstreetmap.org" />
+    <link rel="preconnect" href="https://b.tile.openstreetmap.org" />
+    <link rel="preconnect" href="https://c.tile.openstreetmap.org" />
     <link rel="stylesheet" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.css" />
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/leaflet.draw/1.0.4/leaflet.draw.css"/>
     <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js"></script>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/leaflet.draw/1.0.4/leaflet.draw.js"></script>
+    <script src="qrc:///qtwebchannel/qwebchannel.js"></script>
     <style>
         body { margin: 0; padding: 0; }
         #map { position: absolute; top: 0; bottom: 0; width: 100%; }
@@ -82,7 +271,7 @@ MAP_HTML = """
 <body>
     <div id="map"></div>
     <script>
-        var map = L.map('map').setView([34.0522, -118.2437], 13); // Default: Los Angeles
+        var map = L.map('map').setView([$center_lat, $center_lon], $zoom);
 
         L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
             attribution: '&copy; OpenStreetMap contributors'
@@ -107,8 +296,25 @@ MAP_HTML = """
             if (lastLayer) drawnItems.removeLayer(lastLayer);
             lastLayer = e.layer;
             drawnItems.addLayer(lastLayer);
+            pushSelectionBounds();
+        });
+        map.on(L.Draw.Event.EDITED, pushSelectionBounds);
+        map.on(L.Draw.Event.DELETED, pushSelectionBounds);
+
+        // Python keeps its own copy of the selection, pushed whenever it changes
+        var bridge = null;
+        new QWebChannel(qt.webChannelTransport, function (channel) {
+            bridge = channel.objects.bridge;
+            pushSelectionBounds();
         });
 
+        function pushSelectionBounds() {
+            if (!bridge) return;
+            var bounds = getSelectionBounds();
+            if (bounds) bridge.setBounds(bounds);
+            else bridge.clearBounds();
+        }
+
         function getSelectionBounds() {
             if (drawnItems.getLayers().length === 0) return null;
             var bounds = lastLayer.getBounds();
@@ -127,10 +333,40 @@ MAP_HTML = """
     </script>
 </body>
 </html>
-"""
+""")
+
+@functools.lru_cache(maxsize=4)
+def map_html(center_lat: float, center_lon: float, zoom: int) -> str:
+    """Renders the map selector page for the given initial view."""
+    return MAP_TEMPLATE.substitute(center_lat=center_lat, center_lon=center_lon, zoom=zoom)
+def configure_web_profile():
+    """Sets up the process-wide web profile; repeated calls (one per window) are no-ops."""
+    profile = QWebEngineProfile.defaultProfile()
+    profile.setHttpCacheType(QWebEngineProfile.DiskHttpCache)
+    # The OSM tile usage policy asks clients to identify the application
+    user_agent = profile.httpUserAgent()
+    if APP_USER_AGENT_TAG not in user_agent.split():
+        profile.setHttpUserAgent(f"{user_agent} {APP_USER_AGENT_TAG}")
+
+class MapBridge(QObject):
+    """Holds the rectangle selected on the map, as pushed by the page over QWebChannel."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.bounds = None
+
+    @pyqtSlot('QVariantMap')
+    def setBounds(self, bounds):
+        self.bounds = dict(bounds)
+
+    @pyqtSlot()
+    def clearBounds(self):
+        self.bounds = None
+
 class SumoWorker(QThread):
     log_signal = pyqtSignal(str)    
     finished_signal = pyqtSignal(bool, object) 
+    _located_sumo_home: Optional[str] = None
+    _binaries: Dict[Tuple[str, str], str] = {}
     
     def __init__(self, config):
         super().__init__()
@@ -141,6 +377,7 @@ class SumoWorker(QThread):
         self.sumo_home = ""
         self.attack_start = config.get('attack_start', 100)
         self.attack_duration = config.get('attack_duration', 500)
+        self._cancelled = False
 
     def run(self):
         self.log_signal.emit("--- Starting SUMO Generation Process ---")
@@ -164,7 +401,6 @@ class SumoWorker(QThread):
             else:
                 self.finished_signal.emit(False, None)
         except Exception as e:
-            import traceback
             self.log_signal.emit(f"❌ Unexpected Error: {str(e)}")
             self.log_signal.emit(traceback.format_exc())
             self.finished_signal.emit(False, None)
@@ -173,11 +409,16 @@ class SumoWorker(QThread):
         self.log_signal.emit(msg)
 
     def find_sumo_and_add_path(self) -> bool:
-        sumo_home = os.environ.get('SUMO_HOME')
+        # Probing is done once per session; later workers reuse the result
+        sumo_home = SumoWorker._located_sumo_home or os.environ.get('SUMO_HOME')
         if not sumo_home:
-            sumo_bin = shutil.which("sumo")
-            if sumo_bin:
-                sumo_home = os.path.dirname(os.path.dirname(sumo_bin))
+            # netconvert is the binary this tool needs; realpath follows PATH symlinks
+            # (e.g. /usr/local/bin/netconvert -> <SUMO_HOME>/bin/netconvert)
+            netconvert_bin = shutil.which("netconvert")
+            if netconvert_bin:
+                sumo_home = os.path.dirname(os.path.dirname(os.path.realpath(netconvert_bin)))
+            if not sumo_home or not os.path.exists(os.path.join(sumo_home, 'tools')):
+                sumo_home = None
         if not sumo_home:
             defaults = {
                 "Windows": [r"C:\Program Files (x86)\Eclipse\Sumo", r"C:\Sumo"],
@@ -190,6 +431,7 @@ class SumoWorker(QThread):
                     sumo_home = path
                     break
         if sumo_home and os.path.exists(os.path.join(sumo_home, 'tools')):
+            SumoWorker._located_sumo_home = sumo_home
             self.sumo_home = sumo_home
             os.environ['SUMO_HOME'] = sumo_home
 
@@ -203,41 +445,118 @@ class SumoWorker(QThread):
         self.log("❌ Error: Could not automatically locate SUMO installation.")
         return False
 
+    def sumo_binary(self, name: str) -> str:
+        """Resolves a SUMO executable once per session, preferring the one in SUMO_HOME/bin."""
+        key = (self.sumo_home, name)
+        if key not in SumoWorker._binaries:
+            SumoWorker._binaries[key] = (shutil.which(name, path=os.path.join(self.sumo_home, 'bin'))
+                                         or shutil.which(name) or name)
+        return SumoWorker._binaries[key]
+
     def run_command(self, command: List[str], description: str) -> bool:
-        self.log(f"\n▶️ Running: {description}...")
-        try:
-            process = subprocess.Popen(
-                command, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = process.communicate()
-            
-            if stdout: self.log(f"[STDOUT] {stdout[:500]}..." if len(stdout)>500 else f"[STDOUT] {stdout}")
-            if stderr: self.log(f"[STDERR] {stderr[:500]}..." if len(stderr)>500 else f"[STDERR] {stderr}")
-            
-            if process.returncode == 0:
+        return self.run_commands([(command, description)])[0]
+
+    def run_commands(self, jobs: List[Tuple[List[str], str]]) -> List[bool]:
+        """Runs commands concurrently as QProcesses, streaming their merged output to the log.
+
+        Returns one success flag per job; the processes are killed if cancel() is called.
+        """
+        results = [False] * len(jobs)
+        if self._cancelled:
+            for _, description in jobs:
+                self.log(f"⏹️ {description} skipped: generation was cancelled.")
+            return results
+
+        loop = QEventLoop()
+        running = []
+
+        def on_finished(index, process, description):
+            self.forward_output(process, description, flush=True)
+            if process.exitStatus() == QProcess.NormalExit and process.exitCode() == 0:
                 self.log(f"✅ {description} finished successfully.")
-                return True
+                results[index] = True
+            elif self._cancelled:
+                self.log(f"⏹️ {description} cancelled.")
             else:
-                self.log(f"❌ {description} failed with return code {process.returncode}.")
-                return False
-        except FileNotFoundError:
-            self.log(f"❌ Command not found: {command[0]}")
+                self.log(f"❌ {description} failed with return code {process.exitCode()}.")
+            running.remove(process)
+            if not running:
+                loop.quit()
+
+        def kill_if_cancelled():
+            if self._cancelled:
+                for process in running:
+                    process.kill()
+
+        for index, (command, description) in enumerate(jobs):
+            self.log(f"\n▶️ Running: {description}...")
+            process = QProcess()
+            process.setProcessChannelMode(QProcess.MergedChannels)
+            process.readyReadStandardOutput.connect(lambda p=process, d=description: self.forward_output(p, d))
+            process.finished.connect(lambda *_, i=index, p=process, d=description: on_finished(i, p, d))
+            process.start(command[0], command[1:])
+            if not process.waitForStarted(-1):
+                self.log(f"❌ Command not found: {command[0]}")
+                continue
+            running.append(process)
+
+        # Processes that already exited have removed themselves from `running`,
+        # so the loop is only entered while something can still quit it.
+        if running:
+            cancel_timer = QTimer()
+            cancel_timer.timeout.connect(kill_if_cancelled)
+            cancel_timer.start(100)
+            loop.exec_()
+            cancel_timer.stop()
+        return results
+
+    def forward_output(self, process: QProcess, description: str, flush: bool = False):
+        while process.canReadLine():
+            line = bytes(process.readLine()).decode(errors="replace")
+            self.log(f"[{description}] {line.rstrip()}")
+        if flush:
+            rest = bytes(process.readAll()).decode(errors="replace")
+            if rest:
+                self.log(f"[{description}] {rest.rstrip()}")
+
+    def cancel(self):
+        """Requests the running generation to stop.
+
+        External tools are killed; the in-process Python tools (OSM download, random
+        trips) cannot be interrupted safely and finish first, after which the run stops.
+        """
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def run_tool(self, entry_point: Callable[[List[str]], object], args: List[str], description: str) -> bool:
+        """Runs a SUMO Python tool in-process, forwarding its console output to the log."""
+        if self._cancelled:
+            self.log(f"⏹️ {description} skipped: generation was cancelled.")
             return False
+        self.log(f"\n▶️ Running: {description}...")
+        stream = LogStream(lambda line: self.log(f"[{description}] {line}"))
+        try:
+            with contextlib.redirect_stdout(stream), contextlib.redirect_stderr(stream):
+                entry_point(args)
+            exit_code = 0
+        except SystemExit as e:
+            # SUMO tools report failures (including bad arguments) through sys.exit
+            exit_code = e.code
         except Exception as e:
             self.log(f"❌ Error executing {description}: {e}")
             return False
-    def cleanup(self, filename):
-        files = ["routes.rou.xml", f"{filename}.rou.alt.xml", f"{filename}.trip.xml"]
-        for f in files:
-            if os.path.exists(f):
-                try:
-                    os.remove(f)
-                    self.log(f"Removed temp file: {f}")
-                except: pass 
+        finally:
+            stream.close()
+
+        if exit_code in (None, 0):
+            self.log(f"✅ {description} finished successfully.")
+            return True
+        else:
+            self.log(f"❌ {description} failed with exit status {exit_code}.")
+            return False
     def generate_Blocked_omnetini_File(self, filename , pg_x, pg_y, rsu_x, rsu_y, end_time ,target_edge: str , type : str):
         content = f"""[General]
 cmdenv-express-mode = true
@@ -373,8 +692,10 @@ sim-time-limit = {end_time}s
 
 """
         name = f"{filename}_Blocked.omnetpp.ini"
-        with open(name, 'w') as f: f.write(content)
-        self.log(f"Created {name}")
+        if write_if_changed(name, content):
+            self.log(f"Created {name}")
+        else:
+            self.log(f"Unchanged {name}")
         return name         
     def most_used_route_finder(self, route_file: str, top_n: int = 10) -> List[Tuple[str, int]]:
         if not os.path.exists(route_file):
@@ -426,12 +747,13 @@ sim-time-limit = {end_time}s
         route_file = f"{filename}.rou.xml"
         self.log("--- Step 1: Map Data Setup ---")
         
-        osm_file_exists = os.path.exists(osm_file)
+        try:
+            file_size = os.path.getsize(osm_file)
+        except FileNotFoundError:
+            file_size = None
         should_download = True 
 
-        if osm_file_exists:
-            file_size = os.path.getsize(osm_file)
-            
+        if file_size is not None:
             if file_size > MIN_OSM_FILE_SIZE:
                 self.log(f"✅ Found existing OSM file: '{osm_file}' (Size: {file_size // 1024} KB)")
                 self.log("ℹ️ Skipping download step and using existing file.")
@@ -441,68 +763,101 @@ sim-time-limit = {end_time}s
                 self.log("ℹ️ Re-downloading map data to ensure completeness.")
                 # should_download remains True
 
+        if should_download:
+            bbox_key = f"{self.bbox['west']:.5f},{self.bbox['south']:.5f},{self.bbox['east']:.5f},{self.bbox['north']:.5f}"
+            cached_osm = os.path.join(OSM_CACHE_DIR, f"{hashlib.sha1(bbox_key.encode()).hexdigest()}.osm")
+            if os.path.exists(cached_osm):
+                link_or_copy(cached_osm, osm_file)
+                # The link carries the cache entry's old mtime; refresh it so outputs
+                # derived from a previous area are not mistaken for up to date.
+                os.utime(osm_file)
+                self.log(f"✅ Reusing cached map data for this area: '{cached_osm}'")
+                should_download = False
+
         if should_download:
             self.log(f"ℹ️ Starting download...")
             
-            download_script = os.path.join(self.sumo_home, 'tools', 'osmGet.py')
+            import osmGet
             bbox_str = f"{self.bbox['west']},{self.bbox['south']},{self.bbox['east']},{self.bbox['north']}"
             
-            cmd = [sys.executable, download_script, f"--bbox={bbox_str}", "-p", filename, "-d", "."]
-            
-            if not self.run_command(cmd, "OSM Download"): return False, "", "", None
-            generated_files = glob.glob(f"{filename}*_bbox.osm.xml")
-            
-            if generated_files:
+            # Download into a private directory next to the target so the single file
+            # osmGet produces is known without scanning the working directory.
+            base_name = os.path.basename(filename)
+            with tempfile.TemporaryDirectory(prefix=f".{base_name}-osm-", dir=os.path.dirname(osm_file) or ".") as download_dir:
+                args = [f"--bbox={bbox_str}", "-p", base_name, "-d", download_dir]
+
+                if not self.run_tool(osmGet.get, args, "OSM Download"): return False, "", "", None
+                generated_files = os.listdir(download_dir)
+
+                if not generated_files:
+                    self.log(f"❌ Error: Download finished but expected output file not found.")
+                    return False, "", "", None
                 generated_file = generated_files[0]
-                if os.path.exists(osm_file): os.remove(osm_file)
-                os.rename(generated_file, osm_file)
+                os.replace(os.path.join(download_dir, generated_file), osm_file)
                 self.log(f"✅ Renamed downloaded file '{generated_file}' to '{osm_file}'")
-            elif os.path.exists(f"{filename}.osm.xml"):
-                os.rename(f"{filename}.osm.xml", osm_file)
-                self.log(f"✅ Renamed '{filename}.osm.xml' to '{osm_file}'")
-            else:
-                self.log(f"❌ Error: Download finished but expected output file not found.")
-                return False, "", "", None
+
+            if os.path.getsize(osm_file) > MIN_OSM_FILE_SIZE:
+                try:
+                    os.makedirs(OSM_CACHE_DIR, exist_ok=True)
+                    link_or_copy(osm_file, cached_osm)
+                except OSError as e:
+                    self.log(f"⚠️ Could not cache map data: {e}")
+        # Netconvert cannot consume the download through a FIFO: its OSM importer makes
+        # separate passes over the file (nodes, ways, relations), and Polyconvert and
+        # the caches need the same file afterwards, so the download must finish first.
         self.log("--- Step 2: Converting to Network (Netconvert) ---")
-        net_cmd = [
-    "netconvert", 
-    "--osm-files", osm_file, 
-    "-o", net_file,
-    "--junctions.join",              # Joins nearby nodes into single intersections
-    "--no-internal-links", "false",  # Crucial: enables physical turns for blocking
-    "--keep-edges.components", "1",  # Deletes disconnected "island" roads
-    "--tls.join",                    # Groups traffic lights at large junctions
-    "--geometry.remove",             # Simplifies road shapes for better performance
-    "--roundabouts.guess"            # Identifies roundabouts for better routing
-]
-        if not self.run_command(net_cmd, "Netconvert"): return False, "", "", None
+        # Tools write to a ".part" file that is only moved into place on success, so a
+        # failed or cancelled run never leaves an output that needs_rebuild would trust.
+        net_partial = f"{net_file}.part"
+        net_cmd = [self.sumo_binary("netconvert"), "--osm-files", osm_file, "-o", net_partial] + NETCONVERT_OPTIONS
+        if not needs_rebuild(net_file, osm_file):
+            self.log(f"ℹ️ '{net_file}' is newer than '{osm_file}', skipping Netconvert.")
+        else:
+            # The network is a pure function of the OSM data and the options, so it is
+            # cached under both hashes and shared between scenario names.
+            options_key = hashlib.sha1(",".join(NETCONVERT_OPTIONS).encode()).hexdigest()
+            cached_net = os.path.join(NET_CACHE_DIR, f"{file_sha256(osm_file)}-{options_key}.net.xml.gz")
+            if os.path.exists(cached_net):
+                gunzip_file(cached_net, net_file)
+                self.log(f"✅ Reusing cached network for this map data: '{cached_net}'")
+            else:
+                if not publish_output(self.run_command(net_cmd, "Netconvert"), net_partial, net_file):
+                    return False, "", "", None
+                try:
+                    os.makedirs(NET_CACHE_DIR, exist_ok=True)
+                    gzip_file(net_file, cached_net)
+                except OSError as e:
+                    self.log(f"⚠️ Could not cache network: {e}")
+        # Steps 3 and 4 share no files (osm -> poly vs. net -> trips), so the in-process
+        # trip generation runs on a helper thread while this thread drives Polyconvert.
         self.log("--- Step 3: Generating Polygons (Polyconvert) ---")
+        poly_cmd = None
         typemap = os.path.join(self.sumo_home, 'data', 'typemap', 'osmPolyconvert.typ.xml')
-        if os.path.exists(typemap):
-            self.run_command(["polyconvert", "--osm-files", osm_file, "--type-file", typemap, "-o", poly_file], "Polyconvert")
+        if not needs_rebuild(poly_file, osm_file):
+            self.log(f"ℹ️ '{poly_file}' is newer than '{osm_file}', skipping Polyconvert.")
+        elif os.path.exists(typemap):
+            poly_partial = f"{poly_file}.part"
+            poly_cmd = [self.sumo_binary("polyconvert"), "--osm-files", osm_file, "--type-file", typemap, "-o", poly_partial]
         else:
             self.log("⚠️ Typemap not found, skipping Polyconvert.")
         self.log("--- Step 4: Generating Random Trips ---")
-        random_trips_script = os.path.join(self.sumo_home, 'tools', 'randomTrips.py')
+        import randomTrips
         trip_period = self.end_time / self.num_trips
         
-        trips_cmd = [
-            sys.executable, random_trips_script,
+        trips_args = [
             "-n", net_file,
             "-o", trip_file,
             "-e", str(self.end_time),
-            "-p", str(trip_period),
-            "--validate"
+            "-p", str(trip_period)
         ]
-        if not self.run_command(trips_cmd, "Random Trips"): return False, "", "", None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            trips_future = pool.submit(self.run_tool, lambda args: randomTrips.main(randomTrips.get_options(args)), trips_args, "Random Trips")
+            if poly_cmd and not publish_output(self.run_command(poly_cmd, "Polyconvert"), poly_partial, poly_file):
+                self.log(f"⚠️ '{poly_file}' was not updated; continuing without new polygons.")
+            trips_ok = trips_future.result()
+        if not trips_ok: return False, "", "", None
         self.log("--- Step 5: Calculating Routes (DUAROUTER) ---")
-        dua_cmd = [
-            "duarouter",
-            "-n", net_file,
-            "-t", trip_file,
-            "-o", route_file
-        ]
-        if not self.run_command(dua_cmd, "DUAROUTER"): return False, "", "", None
+        if not self.route_trips(net_file, trip_file, route_file): return False, "", "", None
         self.log("--- Step 6: Analyzing Route Usage and Plotting ---")
         
         top_edges_list = self.most_used_route_finder(route_file, top_n=10)
@@ -547,6 +902,30 @@ sim-time-limit = {end_time}s
         self.log("--- Step 8: Cleaning up ---")
         self.cleanup(filename)
         return True, launchd_clean, launched_blocked , sumocfg_clean, plot_figure , sumocfg_blocked 
+    def route_trips(self, net_file: str, trip_file: str, route_file: str) -> bool:
+        """Routes the trips with duarouter, split across one process per CPU for large trip counts."""
+        # --ignore-errors drops unroutable trips, which randomTrips --validate used to
+        # do with an extra full duarouter pass of its own
+        dua_options = ["-n", net_file, "--ignore-errors"]
+        shard_count = min(os.cpu_count() or 1, max(1, self.num_trips // MIN_TRIPS_PER_SHARD))
+        if shard_count == 1:
+            return self.run_command([self.sumo_binary("duarouter"), *dua_options, "-t", trip_file, "-o", route_file], "DUAROUTER")
+
+        shard_parent = os.path.dirname(route_file) or "."
+        with tempfile.TemporaryDirectory(prefix=f".{os.path.basename(self.filename)}-routes-", dir=shard_parent) as shard_dir:
+            trip_shards = [os.path.join(shard_dir, f"shard{i}.trip.xml") for i in range(shard_count)]
+            route_shards = [os.path.join(shard_dir, f"shard{i}.rou.xml") for i in range(shard_count)]
+            self.log(f"ℹ️ Splitting trips into {shard_count} shards for parallel routing...")
+            definitions = split_trips(trip_file, trip_shards)
+
+            jobs = [([self.sumo_binary("duarouter"), *dua_options, "-t", trips, "-o", routes], f"DUAROUTER {i + 1}/{shard_count}")
+                    for i, (trips, routes) in enumerate(zip(trip_shards, route_shards))]
+            if not all(self.run_commands(jobs)):
+                return False
+            merge_routes(route_shards, route_file, definitions)
+        self.log(f"✅ Merged {shard_count} route shards into '{route_file}'")
+        return True
+
     def generate_launchd(self, filename , type : str):
         content = f"""<?xml version="1.0"?>
 <launch>
@@ -556,15 +935,19 @@ sim-time-limit = {end_time}s
     <copy file="{filename}_{type}.sumo.cfg" type="config" />
 </launch>"""
         name = f"{filename}_{type}.launchd.xml"
-        with open(name, 'w') as f: f.write(content)
-        self.log(f"Created {name}")
+        if write_if_changed(name, content):
+            self.log(f"Created {name}")
+        else:
+            self.log(f"Unchanged {name}")
         return name
 
     def generate_sumocfg(self, filename, route_file , type : str):
         log_dir = f"{filename}-logs"
-        if not os.path.exists(log_dir):
+        try:
             os.makedirs(log_dir)
             self.log(f"✅ Created output directory: {log_dir}/")
+        except FileExistsError:
+            pass
         os.makedirs(os.getcwd() , exist_ok=True)
         summary_output = os.path.join(os.getcwd(), f"{log_dir}/{filename}_{type}_summary_output.xml")
         tripinfo_output = os.path.join(os.getcwd(), f"{log_dir}/{filename}_{type}_tripinfo_output.xml")
@@ -589,8 +972,10 @@ sim-time-limit = {end_time}s
     </output>
 </configuration>"""
         name = f"{filename}_{type}.sumo.cfg"
-        with open(name, 'w') as f: f.write(content)
-        self.log(f"Created {name}")
+        if write_if_changed(name, content):
+            self.log(f"Created {name}")
+        else:
+            self.log(f"Unchanged {name}")
         return name
     def generate_omnetpp_ini(self, filename , pg_x, pg_y, rsu_x, rsu_y, end_time , type : str):
         content = f"""[General]
@@ -724,19 +1109,23 @@ sim-time-limit = {end_time}s
 
 """
         name = f"{filename}_Clean.omnetpp.ini"
-        with open(name, 'w') as f: f.write(content)
-        self.log(f"Created {name}")
+        if write_if_changed(name, content):
+            self.log(f"Created {name}")
+        else:
+            self.log(f"Unchanged {name}")
         return name  
     def cleanup(self, filename):
         files = ["routes.rou.xml", f"{filename}.rou.alt.xml", f"{filename}.trip.xml"]
         for f in files:
-            if os.path.exists(f):
-                try:
-                    os.remove(f)
-                    self.log(f"Removed temp file: {f}")
-                except: pass
+            try:
+                os.unlink(f)
+                self.log(f"Removed temp file: {f}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.log(f"⚠️ Could not remove temp file {f}: {e}")
 class SumoApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, map_center: Tuple[float, float] = DEFAULT_MAP_CENTER, map_zoom: int = DEFAULT_MAP_ZOOM):
         super().__init__()
         self.setWindowTitle("Veins/SUMO Scenario Generator")
         self.resize(1200, 850)
@@ -770,22 +1159,48 @@ class SumoApp(QMainWindow):
         self.btn_generate.setStyleSheet("background-color: #0078D7; color: white; font-weight: bold; padding: 8px;")
         self.btn_generate.clicked.connect(self.start_process)
         controls_layout.addWidget(self.btn_generate)   
+        self.btn_cancel = QPushButton("Cancel")
+        self.btn_cancel.setEnabled(False)
+        self.btn_cancel.setToolTip("Stops Netconvert, Polyconvert and DUAROUTER immediately. "
+                                   "A running OSM download or trip generation finishes first, then the run stops.")
+        self.btn_cancel.clicked.connect(self.cancel_process)
+        controls_layout.addWidget(self.btn_cancel)
         layout.addLayout(controls_layout)
         self.tabs = QTabWidget()
         self.map_view = QWebEngineView()
-        self.map_view.setHtml(MAP_HTML)
+        # Load the page from a file rather than setHtml so Chromium can cache the
+        # Leaflet assets and tiles on disk across launches.
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # One file per start view: setUrl loads asynchronously, so a shared file could be
+        # rewritten for another window's view before this one has read it
+        map_file = os.path.join(CACHE_DIR, f"map-{map_center[0]}_{map_center[1]}_{map_zoom}.html")
+        write_if_changed(map_file, map_html(*map_center, map_zoom))
+        configure_web_profile()
+        self.map_bridge = MapBridge(self)
+        self.map_channel = QWebChannel(self)
+        self.map_channel.registerObject("bridge", self.map_bridge)
+        self.map_view.page().setWebChannel(self.map_channel)
+        self.map_view.setUrl(QUrl.fromLocalFile(map_file))
         self.tabs.addTab(self.map_view, "1. Select Area")
         self.log_view = QTextEdit()
         self.log_view.setReadOnly(True)
         self.log_view.setStyleSheet("background-color: #1e1e1e; color: #00ff00; font-family: monospace;")
+        self.log_view.document().setMaximumBlockCount(LOG_MAX_LINES)
         self.tabs.addTab(self.log_view, "2. Process Log")
+        # Worker output is coalesced and flushed in batches so a chatty tool
+        # costs one layout pass per interval instead of one per line.
+        self._log_buffer = []
+        self._log_timer = QTimer(self)
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self._log_timer.timeout.connect(self.flush_log)
         self.plot_viewer = PlotViewer()
         self.tabs.addTab(self.plot_viewer, "3. Route Analysis Plot")
         
         layout.addWidget(self.tabs)
 
     def start_process(self):
-        self.map_view.page().runJavaScript("getSelectionBounds()", self.handle_bounds)
+        self.handle_bounds(self.map_bridge.bounds)
     def handle_bounds(self, bounds):
         """
         Handles the bounds data and initiates the worker thread.
@@ -793,10 +1208,10 @@ class SumoApp(QMainWindow):
         """
         filename = self.filename_edit.text().strip()
         osm_file = f"{filename}.osm"
-        is_valid_file = False
-        if os.path.exists(osm_file):
-            if os.path.getsize(osm_file) > MIN_OSM_FILE_SIZE:
-                is_valid_file = True
+        try:
+            is_valid_file = os.path.getsize(osm_file) > MIN_OSM_FILE_SIZE
+        except FileNotFoundError:
+            is_valid_file = False
         if not bounds:
             if is_valid_file:
                 QMessageBox.information(self, "Using Existing File", f"No area selected. Proceeding with analysis and generation using existing file: {osm_file}")
@@ -814,21 +1229,37 @@ class SumoApp(QMainWindow):
             'attack_duration': self.attack_duration_spin.value()
         }
         self.tabs.setCurrentIndex(1)
+        self._log_buffer.clear()
         self.log_view.clear()
         self.btn_generate.setEnabled(False)
+        self.btn_cancel.setEnabled(True)
         self.worker = SumoWorker(config)
         self.worker.log_signal.connect(self.update_log)
         self.worker.finished_signal.connect(self.process_finished) 
         self.worker.start()
 
+    def cancel_process(self):
+        self.btn_cancel.setEnabled(False)
+        self.update_log("\n⏹️ Cancelling...")
+        self.worker.cancel()
+
     def update_log(self, text):
-        self.log_view.append(text)
-        cursor = self.log_view.textCursor()
-        cursor.movePosition(cursor.End)
-        self.log_view.setTextCursor(cursor)
+        self._log_buffer.append(text)
+        if not self._log_timer.isActive():
+            self._log_timer.start()
+
+    def flush_log(self):
+        if not self._log_buffer:
+            return
+        # insertPlainText never interprets tool output as rich text, unlike append()
+        self.log_view.moveCursor(QTextCursor.End)
+        self.log_view.insertPlainText("\n".join(self._log_buffer) + "\n")
+        self._log_buffer.clear()
         
     def process_finished(self, success: bool, plot_figure: Optional[Figure]): 
+        self.flush_log()
         self.btn_generate.setEnabled(True)
+        self.btn_cancel.setEnabled(False)
         filename = self.filename_edit.text().strip()
         
         if success:
@@ -837,6 +1268,8 @@ class SumoApp(QMainWindow):
             if plot_figure:
                 self.plot_viewer.set_plot(plot_figure, filename)
                 self.tabs.setCurrentIndex(2)
+        elif self.worker.cancelled:
+            QMessageBox.information(self, "Cancelled", "Generation was cancelled. Files written so far were kept.")
         else:
             QMessageBox.critical(self, "Failed", "Process failed. Check the logs for details.")
 